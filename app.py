@@ -4,9 +4,26 @@ Complete Flask Blog Application - Single File Solution
 Fixed all import issues and database problems
 """
 
+import atexit
+import cProfile
+import functools
+import hashlib
+import hmac
+import io
 import os
+import pstats
+import queue
 import sqlite3
-from flask import Flask, render_template_string, request, redirect, url_for, flash
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+import click
+from flask import Flask, render_template_string, request, redirect, url_for, flash, g, jsonify, Response
+from markupsafe import escape
 
 # Configuration
 app = Flask(__name__)
@@ -21,86 +38,796 @@ else:
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     DB_PATH = os.path.join(BASE_DIR, 'blog.db')
 
-# Database connection variables
-conn = None
-cursor = None
+# Explicit override, used by bench.py to work on a scratch database
+if os.environ.get('BLOG_DB_PATH'):
+    DB_PATH = os.environ['BLOG_DB_PATH']
+
+# Share one in-flight listing render between concurrent identical requests
+# Set BLOG_COALESCE=0 to let every request run its own query and render
+COALESCE_REQUESTS = os.environ.get('BLOG_COALESCE', '1') != '0'
+
+# Listing pagination and the per-worker buffer of newest posts
+# Keep BLOG_RECENT_POSTS >= BLOG_PAGE_SIZE so the first page never hits the database
+PAGE_SIZE = int(os.environ.get('BLOG_PAGE_SIZE', 20))
+RECENT_POSTS = int(os.environ.get('BLOG_RECENT_POSTS', 50))
+
+# Upper bound for rendered post cards kept in memory, in characters of HTML
+FRAGMENT_CACHE_SIZE = int(os.environ.get('BLOG_FRAGMENT_CACHE_SIZE', 8 * 1024 * 1024))
+
+# Cut post text in listings to this many characters (0 shows the full text)
+PREVIEW_CHARS = int(os.environ.get('BLOG_PREVIEW_CHARS', 0))
+
+# Live updates over Server-Sent Events. Each open stream holds a worker
+# thread, so run gunicorn with threads (gunicorn.conf.py sets BLOG_THREADS)
+STREAM_MAX_CLIENTS = int(os.environ.get('BLOG_STREAM_MAX_CLIENTS', 4))
+STREAM_POLL_INTERVAL = float(os.environ.get('BLOG_STREAM_POLL_INTERVAL', 1.0))
+STREAM_KEEPALIVE = 15
+STREAM_QUEUE_SIZE = 100
+STREAM_RETRY_SECONDS = 3
+
+# View counts are buffered per worker and written in one transaction every
+# BLOG_VIEW_FLUSH_EVENTS page views or BLOG_VIEW_FLUSH_INTERVAL seconds
+VIEW_FLUSH_EVENTS = int(os.environ.get('BLOG_VIEW_FLUSH_EVENTS', 100))
+VIEW_FLUSH_INTERVAL = float(os.environ.get('BLOG_VIEW_FLUSH_INTERVAL', 5.0))
+VIEW_MAX_PENDING = 10000
+VIEW_TOTALS_CACHE_SIZE = 100000
+POPULAR_POSTS = 20
+
+# Admission control: each listing route may build BLOG_READ_LIMIT distinct
+# pages at once per worker (identical requests share the single-flight
+# leader's slot) and all publishing BLOG_WRITE_LIMIT; up to the matching
+# *_QUEUE more wait at most BLOG_ADMISSION_TIMEOUT seconds, the rest get a
+# 503 with Retry-After straight away instead of tying up a worker thread
+ADMISSION_ENABLED = os.environ.get('BLOG_ADMISSION', '1') != '0'
+READ_LIMIT = int(os.environ.get('BLOG_READ_LIMIT', 4))
+READ_QUEUE = int(os.environ.get('BLOG_READ_QUEUE', 4))
+WRITE_LIMIT = int(os.environ.get('BLOG_WRITE_LIMIT', 1))
+WRITE_QUEUE = int(os.environ.get('BLOG_WRITE_QUEUE', 2))
+ADMISSION_TIMEOUT = float(os.environ.get('BLOG_ADMISSION_TIMEOUT', 0.25))
+ADMISSION_RETRY_AFTER = 1
+
+# Archive mode: posts older than BLOG_ARCHIVE_AFTER_DAYS are moved by
+# `flask --app app compact-posts` into a second SQLite file that is ATTACHed as
+# "archive", keeping the hot post table, its indexes and backups small
+ARCHIVE_ENABLED = os.environ.get('BLOG_ARCHIVE') == '1'
+ARCHIVE_DB_PATH = os.environ.get('BLOG_ARCHIVE_DB_PATH', os.path.splitext(DB_PATH)[0] + '-archive.db')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('BLOG_ARCHIVE_AFTER_DAYS', 180))
+
+# On-demand profiling for admins (see the Profiling section below)
+# Nothing is registered unless BLOG_PROFILING=1, so it costs nothing when off
+PROFILING_ENABLED = os.environ.get('BLOG_PROFILING') == '1'
+PROFILE_DIR = os.environ.get('BLOG_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'blog-profiles'))
+
+# Database connection helpers
+# Each thread keeps one connection open and every call gets its own cursor,
+# so helpers are safe to use from threaded workers (gunicorn --threads).
+# Connections are never shared across fork: init_worker() drops them.
+_db = threading.local()
 
 def open_db():
-    global conn, cursor
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-def close_db():
-    if cursor:
-        cursor.close()
-    if conn:
+    conn = getattr(_db, 'conn', None)
+    if conn is None:
+        conn = _db.conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        if ARCHIVE_ENABLED:
+            conn.execute('ATTACH DATABASE ? AS archive', [ARCHIVE_DB_PATH])
+    elif conn.in_transaction:
+        # A helper failed halfway; don't keep its locks for the next one
+        conn.rollback()
+    return conn.cursor()
+
+def close_db(cursor):
+    cursor.close()
+
+def close_connection():
+    conn = getattr(_db, 'conn', None)
+    if conn is not None:
+        _db.conn = None
         conn.close()
 
 def do_query(query, params=None):
     if params is None:
         params = []
+    cursor = open_db()
     cursor.execute(query, params)
-    conn.commit()
+    cursor.connection.commit()
+    close_db(cursor)
+
+# Listing rows
+# Listings only need post_id, category_name and text, so their queries select
+# just those columns into PostRecord instead of full sqlite3.Row objects.
+# Category names are interned, so thousands of rows share a handful of strings.
+class PostRecord:
+    """Compact listing row; post["text"] works as it does for sqlite3.Row"""
+
+    __slots__ = ('post_id', 'category_name', 'text')
+
+    def __init__(self, post_id, category_name, text):
+        self.post_id = post_id
+        self.category_name = category_name
+        self.text = text
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+def preview_text(text):
+    if PREVIEW_CHARS and len(text) > PREVIEW_CHARS:
+        return text[:PREVIEW_CHARS].rstrip() + '…'
+    return text
+
+def post_record(cursor, row):
+    """sqlite3 row_factory for (post_id, category_name, text) queries"""
+    return PostRecord(row[0], sys.intern(row[1]), preview_text(row[2]))
+
+# With previews on, SQLite hands back only one character more than is shown
+POST_TEXT = f'substr(p.text, 1, {PREVIEW_CHARS + 1})' if PREVIEW_CHARS else 'p.text'
 
 # Database functions (fixed versions)
 def getUser():
-    open_db()
+    cursor = open_db()
     cursor.execute('''SELECT * FROM user LIMIT 1''')
     user = cursor.fetchone()
-    close_db()
+    close_db(cursor)
     return user
 
 def getAuthData():
-    open_db()
+    cursor = open_db()
     cursor.execute('''SELECT * FROM users LIMIT 1''')
     data = cursor.fetchone()
-    close_db()
+    close_db(cursor)
     if data:
         return {'login': data[0], 'password': data[1]}
     return None
 
-def getPostsByCategory(category_name):
-    open_db()
-    cursor.execute('''SELECT p.*, c.category_name 
+def getPostsByCategory(category_name, limit=-1, offset=0):
+    cursor = open_db()
+    cursor.row_factory = post_record
+    cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
                      FROM post p, category c 
                      WHERE p.category_id = c.category_id 
                      AND c.category_name = ? 
-                     ORDER BY p.post_id DESC''', [category_name])
+                     ORDER BY p.post_id DESC
+                     LIMIT ? OFFSET ?''', [category_name, limit, offset])
     posts = cursor.fetchall()
-    close_db()
+    close_db(cursor)
     return posts
 
+# Categories are never renamed or deleted, so each worker remembers the ids it has seen
+category_ids = {}
+
+def loadCategoryIds():
+    cursor = open_db()
+    cursor.execute('''SELECT category_name, category_id FROM category''')
+    category_ids.update((row['category_name'], row['category_id']) for row in cursor)
+    close_db(cursor)
+
 def getIdByCategory(category_name):
-    open_db()
+    category_id = category_ids.get(category_name)
+    if category_id is not None:
+        return category_id
+    cursor = open_db()
     cursor.execute('''SELECT category_id FROM category WHERE category_name = ?''', [category_name])
     result = cursor.fetchone()
-    close_db()
+    close_db(cursor)
     if result:
+        category_ids[category_name] = result['category_id']
         return result['category_id']
     else:
         return None
 
-def addPost(category_id, post_text):
-    open_db()
-    cursor.execute('''INSERT INTO post (category_id, text) VALUES (?, ?)''', [category_id, post_text])
-    conn.commit()
-    close_db()
+def contentHash(post_text):
+    return hashlib.sha256(post_text.encode('utf-8')).hexdigest()
+
+def addPost(category_id, post_text, form_token=None):
+    """Publish a post; returns its post_id, or None for a duplicate or a repeated form submit"""
+    cursor = open_db()
+    if ARCHIVE_ENABLED:
+        # Take the write lock before checking the archive, so compact_posts()
+        # can't move the original post in between the check and the insert
+        cursor.execute('BEGIN IMMEDIATE')
+    if form_token:
+        cursor.execute('''DELETE FROM post_submission WHERE created_at < datetime('now', '-1 day')''')
+        cursor.execute('''INSERT OR IGNORE INTO post_submission (token) VALUES (?)''', [form_token])
+        if cursor.rowcount == 0:
+            cursor.connection.commit()
+            close_db(cursor)
+            return None
+    content_hash = contentHash(post_text)
+    if ARCHIVE_ENABLED:
+        cursor.execute('''SELECT 1 FROM archive.post WHERE category_id = ? AND content_hash = ?''',
+                       [category_id, content_hash])
+        if cursor.fetchone():
+            cursor.connection.commit()
+            close_db(cursor)
+            return None
+    # The unique (category_id, content_hash) index turns a duplicate into a no-op
+    cursor.execute('''INSERT OR IGNORE INTO post (category_id, text, content_hash) VALUES (?, ?, ?)''',
+                   [category_id, post_text, content_hash])
+    if cursor.rowcount == 0:
+        cursor.connection.commit()
+        close_db(cursor)
+        return None
+    post_id = cursor.lastrowid
+    # Read inside the write transaction, so the version belongs to this insert
+    cursor.execute('''SELECT value FROM blog_meta WHERE key = 'posts_version' ''')
+    version = cursor.fetchone()[0]
+    cursor.connection.commit()
+    close_db(cursor)
+    recent_posts.add(category_id, post_id, post_text, version)
+    post_events.notify()
+    return post_id
+
+def get_all_posts(limit=-1, offset=0):
+    cursor = open_db()
+    cursor.row_factory = post_record
+    cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
+                     FROM post p 
+                     JOIN category c ON p.category_id = c.category_id 
+                     ORDER BY p.post_id DESC
+                     LIMIT ? OFFSET ?''', [limit, offset])
+    posts = cursor.fetchall()
+    close_db(cursor)
+    return posts
+
+def getArchivedPosts(category_name=None, limit=-1, offset=0):
+    cursor = open_db()
+    cursor.row_factory = post_record
+    if category_name is None:
+        cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
+                         FROM archive.post p 
+                         JOIN category c ON p.category_id = c.category_id 
+                         ORDER BY p.post_id DESC
+                         LIMIT ? OFFSET ?''', [limit, offset])
+    else:
+        cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
+                         FROM archive.post p, category c 
+                         WHERE p.category_id = c.category_id 
+                         AND c.category_name = ? 
+                         ORDER BY p.post_id DESC
+                         LIMIT ? OFFSET ?''', [category_name, limit, offset])
+    posts = cursor.fetchall()
+    close_db(cursor)
+    return posts
 
-def get_all_posts():
-    open_db()
-    cursor.execute('''SELECT p.*, c.category_name 
+def getPostsSince(post_id, category_name=None, limit=STREAM_QUEUE_SIZE):
+    cursor = open_db()
+    cursor.row_factory = post_record
+    cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
                      FROM post p 
                      JOIN category c ON p.category_id = c.category_id 
-                     ORDER BY p.post_id DESC''')
+                     WHERE p.post_id > ? 
+                     AND (? IS NULL OR c.category_name = ?) 
+                     ORDER BY p.post_id
+                     LIMIT ?''', [post_id, category_name, category_name, limit])
+    posts = cursor.fetchall()
+    close_db(cursor)
+    return posts
+
+def getLatestPostId():
+    cursor = open_db()
+    cursor.execute('''SELECT MAX(post_id) FROM post''')
+    post_id = cursor.fetchone()[0]
+    close_db(cursor)
+    return post_id or 0
+
+def addViewCounts(post_views, category_views):
+    """Apply batched view increments in one transaction; returns the new totals"""
+    cursor = open_db()
+    cursor.executemany('''INSERT INTO post_views (post_id, views) VALUES (?, ?)
+                         ON CONFLICT (post_id) DO UPDATE SET views = views + excluded.views''',
+                       post_views.items())
+    cursor.executemany('''INSERT INTO category_views (category_id, views)
+                         SELECT category_id, ? FROM category WHERE category_name = ?
+                         ON CONFLICT (category_id) DO UPDATE SET views = views + excluded.views''',
+                       [(views, category_name) for category_name, views in category_views.items()])
+    post_totals = {}
+    post_ids = list(post_views)
+    for start in range(0, len(post_ids), 500):
+        chunk = post_ids[start:start + 500]
+        cursor.execute('''SELECT post_id, views FROM post_views WHERE post_id IN (%s)'''
+                       % ','.join('?' * len(chunk)), chunk)
+        post_totals.update((row[0], row[1]) for row in cursor)
+    cursor.execute('''SELECT c.category_name, v.views
+                     FROM category_views v
+                     JOIN category c ON v.category_id = c.category_id''')
+    category_totals = {row[0]: row[1] for row in cursor}
+    cursor.connection.commit()
+    close_db(cursor)
+    return post_totals, category_totals
+
+def getPostViews(post_ids):
+    cursor = open_db()
+    views = {}
+    for start in range(0, len(post_ids), 500):
+        chunk = post_ids[start:start + 500]
+        cursor.execute('''SELECT post_id, views FROM post_views WHERE post_id IN (%s)'''
+                       % ','.join('?' * len(chunk)), chunk)
+        views.update((row[0], row[1]) for row in cursor)
+    close_db(cursor)
+    return views
+
+def getCategoryViews(category_name):
+    cursor = open_db()
+    cursor.execute('''SELECT v.views 
+                     FROM category_views v, category c 
+                     WHERE v.category_id = c.category_id 
+                     AND c.category_name = ?''', [category_name])
+    result = cursor.fetchone()
+    close_db(cursor)
+    return result[0] if result else 0
+
+def getPopularPosts(limit, category_name=None):
+    # Walks idx_post_views_views from the top instead of sorting every post
+    cursor = open_db()
+    cursor.row_factory = post_record
+    cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT} 
+                     FROM post_views v 
+                     JOIN post p ON p.post_id = v.post_id 
+                     JOIN category c ON p.category_id = c.category_id 
+                     WHERE (? IS NULL OR c.category_name = ?) 
+                     ORDER BY v.views DESC
+                     LIMIT ?''', [category_name, category_name, limit])
     posts = cursor.fetchall()
-    close_db()
+    close_db(cursor)
     return posts
 
+def getPostsVersion():
+    cursor = open_db()
+    cursor.execute('''SELECT value FROM blog_meta WHERE key = 'posts_version' ''')
+    version = cursor.fetchone()[0]
+    close_db(cursor)
+    return version
+
+# Request coalescing (single-flight)
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its result"""
+
+    class _Call:
+        __slots__ = ('event', 'result', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Forget the key before waking followers so later requests start fresh
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+listing_flight = SingleFlight()
+
+def coalesced(key, fn, *args):
+    # Only the call that really queries and renders takes a read slot from the
+    # route's gate (see admission_controlled); followers wait on it for free
+    gate = g.get('read_gate')
+    if gate is not None:
+        fn = functools.partial(run_admitted, gate, fn)
+    if not COALESCE_REQUESTS:
+        return fn(*args)
+    return listing_flight.do(key, fn, *args)
+
+# Recent posts (in-memory ring buffers)
+class RecentPosts:
+    """Newest posts overall and per category, kept in memory by each worker
+
+    Triggers bump blog_meta.posts_version on every post change, so a worker
+    reloads its buffers as soon as another worker has written.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.version = None
+        self._lock = threading.Lock()
+        self._all = deque(maxlen=size)
+        self._by_category = {}
+        self._names = {}
+        self._counts = {}
+        self._total = 0
+        self._archived = {}
+        self._archived_total = 0
+
+    def load(self):
+        cursor = open_db()
+        # One read transaction, so the version and the rows share a snapshot
+        cursor.execute('BEGIN')
+        cursor.execute('''SELECT value FROM blog_meta WHERE key = 'posts_version' ''')
+        version = cursor.fetchone()[0]
+        cursor.execute('''SELECT c.category_id, c.category_name, COALESCE(n.count, 0)
+                         FROM category c
+                         LEFT JOIN post_count n ON n.category_id = c.category_id''')
+        categories = cursor.fetchall()
+
+        names, counts, by_category = {}, {}, {}
+        for category_id, category_name, count in categories:
+            cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT}
+                              FROM post p
+                              JOIN category c ON p.category_id = c.category_id
+                              WHERE p.category_id = ?
+                              ORDER BY p.post_id DESC LIMIT ?''', [category_id, self.size])
+            by_category[category_name] = deque(
+                (post_record(cursor, row) for row in cursor), maxlen=self.size)
+            names[category_id] = sys.intern(category_name)
+            counts[category_name] = count
+
+        cursor.execute(f'''SELECT p.post_id, c.category_name, {POST_TEXT}
+                          FROM post p
+                          JOIN category c ON p.category_id = c.category_id
+                          ORDER BY p.post_id DESC LIMIT ?''', [self.size])
+        all_posts = deque((post_record(cursor, row) for row in cursor), maxlen=self.size)
+
+        archived = {}
+        if ARCHIVE_ENABLED:
+            cursor.execute('''SELECT category_id, count FROM archive.post_count''')
+            archived = {names[category_id]: count for category_id, count in cursor
+                        if category_id in names}
+        cursor.connection.rollback()
+        close_db(cursor)
+
+        with self._lock:
+            self._all = all_posts
+            self._by_category = by_category
+            self._names = names
+            self._counts = counts
+            self._total = sum(counts.values())
+            self._archived = archived
+            self._archived_total = sum(archived.values())
+            self.version = version
+
+    def sync(self):
+        if getPostsVersion() != self.version:
+            self.load()
+
+    def add(self, category_id, post_id, text, version):
+        with self._lock:
+            category_name = self._names.get(category_id)
+            if category_name is None or self.version != version - 1:
+                # Another worker wrote in between; reload on the next sync()
+                self.version = None
+                return
+            post = PostRecord(post_id, category_name, preview_text(text))
+            self._all.appendleft(post)
+            self._by_category[category_name].appendleft(post)
+            self._counts[category_name] += 1
+            self._total += 1
+            self.version = version
+
+    def hot_count(self, category_name=None):
+        """Number of posts still in the main post table"""
+        with self._lock:
+            if category_name is None:
+                return self._total
+            return self._counts.get(category_name, 0)
+
+    def count(self, category_name=None):
+        """Number of posts including archived ones"""
+        with self._lock:
+            if category_name is None:
+                return self._total + self._archived_total
+            return self._counts.get(category_name, 0) + self._archived.get(category_name, 0)
+
+    def page(self, category_name, offset, limit):
+        """Return (posts, post_count) from memory, or None if the page is not buffered"""
+        with self._lock:
+            if category_name is None:
+                posts, total = self._all, self._total + self._archived_total
+            else:
+                posts = self._by_category.get(category_name)
+                if posts is None:
+                    return None
+                total = self._counts[category_name] + self._archived.get(category_name, 0)
+            if offset + limit > len(posts) and len(posts) < total:
+                return None
+            return list(islice(posts, offset, offset + limit)), total
+
+recent_posts = RecentPosts(RECENT_POSTS)
+
+# Live updates (Server-Sent Events)
+class PostBroadcaster:
+    """Pushes newly published posts to SSE subscribers of this worker
+
+    A single watcher thread notices new posts, whether published here
+    (addPost calls notify()) or by another worker (posts_version moves; it is
+    polled every STREAM_POLL_INTERVAL seconds while anyone is subscribed),
+    and renders each post once per view for all subscribers.
+    """
+
+    def __init__(self, poll_interval, max_clients):
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._subscribers = set()
+        self._thread = None
+        self._version = None
+        self._last_post_id = None
+
+    def subscribe(self, category_name):
+        """Returns a (category_name, queue) subscription, or None when this worker is full"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            if self._last_post_id is None:
+                # Nobody was listening; start from what is in the database now
+                self._version = getPostsVersion()
+                self._last_post_id = getLatestPostId()
+            subscription = (category_name, queue.Queue(maxsize=STREAM_QUEUE_SIZE))
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='blog-post-broadcaster', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                self._last_post_id = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self._check()
+            except Exception:
+                app.logger.exception('Live post updates failed')
+
+    def _check(self):
+        with self._lock:
+            if self._last_post_id is None:
+                return
+            last_post_id = self._last_post_id
+        version = getPostsVersion()
+        if version == self._version:
+            return
+        # getPostsSince() returns at most STREAM_QUEUE_SIZE posts, so keep going
+        # until a short batch; the version is only recorded once all are sent
+        while True:
+            posts = getPostsSince(last_post_id)
+            for post in posts:
+                self._publish(post)
+                last_post_id = post['post_id']
+                with self._lock:
+                    if self._last_post_id is None:
+                        return
+                    self._last_post_id = last_post_id
+            if len(posts) < STREAM_QUEUE_SIZE:
+                break
+        self._version = version
+
+    def _publish(self, post):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        fragments = {}
+        for category_name, events in subscribers:
+            if category_name is not None and category_name != post['category_name']:
+                continue
+            view = 'all' if category_name is None else 'category'
+            if view not in fragments:
+                fragments[view] = render_post_card(post, view)
+            try:
+                events.put_nowait((post['post_id'], fragments[view]))
+            except queue.Full:
+                # A reader this far behind reconnects and catches up via Last-Event-ID
+                pass
+
+post_events = PostBroadcaster(STREAM_POLL_INTERVAL, STREAM_MAX_CLIENTS)
+
+# View counting
+class ViewCounter:
+    """Per-worker view counts, written to SQLite in batches
+
+    A page view only touches memory. flush() writes everything pending in one
+    transaction once VIEW_FLUSH_EVENTS page views or VIEW_FLUSH_INTERVAL
+    seconds have piled up, so a crashed worker loses at most that many views.
+    At most VIEW_MAX_PENDING distinct posts are held between flushes; views of
+    further posts are dropped (and counted in self.dropped) rather than
+    growing memory while the database is unavailable.
+    """
+
+    def __init__(self, flush_events, flush_interval, max_pending):
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._posts = Counter()
+        self._categories = Counter()
+        self._events = 0
+        self._last_flush = time.monotonic()
+        self._post_totals = {}
+        self._category_totals = {}
+        self._thread = None
+
+    def record(self, category_name, post_ids):
+        with self._lock:
+            if category_name is not None:
+                self._categories[category_name] += 1
+            for post_id in post_ids:
+                if post_id in self._posts or len(self._posts) < self.max_pending:
+                    self._posts[post_id] += 1
+                else:
+                    self.dropped += 1
+            self._events += 1
+            due = self._events >= self.flush_events
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='blog-view-flusher', daemon=True)
+                self._thread.start()
+        if due:
+            self.flush()
+
+    def flush(self):
+        # One flush at a time; whoever loses the race leaves it to the winner
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                posts, categories = self._posts, self._categories
+                self._posts, self._categories = Counter(), Counter()
+                self._events = 0
+                self._last_flush = time.monotonic()
+            if not posts and not categories:
+                return
+            try:
+                post_totals, category_totals = addViewCounts(posts, categories)
+            except sqlite3.Error:
+                app.logger.exception('Flushing view counts failed, will retry')
+                with self._lock:
+                    self._posts.update(posts)
+                    self._categories.update(categories)
+                return
+            with self._lock:
+                if len(self._post_totals) > VIEW_TOTALS_CACHE_SIZE:
+                    self._post_totals.clear()
+                self._post_totals.update(post_totals)
+                self._category_totals.update(category_totals)
+        finally:
+            self._flush_lock.release()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval / 2)
+            with self._lock:
+                due = self._events and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self.flush()
+
+    def post_totals(self, post_ids):
+        """Views per post id: last known database total plus this worker's pending views"""
+        with self._lock:
+            missing = [post_id for post_id in post_ids if post_id not in self._post_totals]
+        if missing:
+            loaded = dict.fromkeys(missing, 0)
+            loaded.update(getPostViews(missing))
+            with self._lock:
+                self._post_totals.update(loaded)
+        with self._lock:
+            return {post_id: self._post_totals.get(post_id, 0) + self._posts.get(post_id, 0)
+                    for post_id in post_ids}
+
+    def category_total(self, category_name):
+        with self._lock:
+            total = self._category_totals.get(category_name)
+        if total is None:
+            total = getCategoryViews(category_name)
+            with self._lock:
+                self._category_totals.setdefault(category_name, total)
+        with self._lock:
+            return self._category_totals[category_name] + self._categories.get(category_name, 0)
+
+view_counts = ViewCounter(VIEW_FLUSH_EVENTS, VIEW_FLUSH_INTERVAL, VIEW_MAX_PENDING)
+atexit.register(view_counts.flush)
+
+def format_post_event(post_id, html):
+    data = ''.join(f'data: {line}\n' for line in html.strip().split('\n'))
+    return f'event: post\nid: {post_id}\n{data}\n'
+
+def event_stream(category_name):
+    subscription = post_events.subscribe(category_name)
+    if subscription is None:
+        return Response('Too many live readers, try again later\n', 503,
+                        {'Retry-After': str(STREAM_RETRY_SECONDS)})
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    
+    def generate():
+        last_sent = last_event_id or 0
+        yield f'retry: {STREAM_RETRY_SECONDS * 1000}\n\n'
+        if last_event_id is not None:
+            # Catch up on what was published while the browser was reconnecting
+            view = 'all' if category_name is None else 'category'
+            for post in getPostsSince(last_event_id, category_name):
+                last_sent = post['post_id']
+                yield format_post_event(last_sent, render_post_card(post, view))
+        events = subscription[1]
+        while True:
+            try:
+                post_id, html = events.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if post_id > last_sent:
+                last_sent = post_id
+                yield format_post_event(post_id, html)
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: post_events.unsubscribe(subscription))
+    return response
+
+def render_live_updates(stream_url):
+    """Script that prepends posts pushed by stream_url to the page's posts grid"""
+    return '''
+    <script>
+        if (window.EventSource) {
+            const source = new EventSource('STREAM_URL');
+            source.addEventListener('post', function (e) {
+                const grid = document.querySelector('.posts-grid');
+                if (!grid) {
+                    window.location.reload();
+                    return;
+                }
+                grid.insertAdjacentHTML('afterbegin', e.data);
+            });
+        }
+    </script>
+    '''.replace('STREAM_URL', stream_url)
+
+def fetch_listing_page(category_name, page):
+    """Return (posts, post_count) for a listing page; category_name=None lists all posts
+
+    Expects recent_posts to be synced already, which requested_page() does.
+    """
+    offset = (page - 1) * PAGE_SIZE
+    buffered = recent_posts.page(category_name, offset, PAGE_SIZE)
+    if buffered is not None:
+        return buffered
+    
+    hot_count = recent_posts.hot_count(category_name)
+    posts = []
+    if offset < hot_count or not ARCHIVE_ENABLED:
+        if category_name is None:
+            posts = get_all_posts(PAGE_SIZE, offset)
+        else:
+            posts = getPostsByCategory(category_name, PAGE_SIZE, offset)
+    # Archived posts are all older than hot ones, so they continue the listing
+    if ARCHIVE_ENABLED and len(posts) < PAGE_SIZE:
+        posts = list(posts) + getArchivedPosts(category_name, PAGE_SIZE - len(posts),
+                                               max(offset - hot_count, 0))
+    return posts, recent_posts.count(category_name)
+
 # Initialize database
 def init_database():
     """Initialize database with tables and sample data"""
-    open_db()
+    cursor = open_db()
     
     # Create tables
     cursor.execute('''
@@ -116,10 +843,141 @@ def init_database():
             category_id INTEGER NOT NULL,
             text TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            content_hash TEXT,
             FOREIGN KEY (category_id) REFERENCES category (category_id)
         )
     ''')
     
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_post_category ON post (category_id, post_id)
+    ''')
+    
+    # Databases created before content_hash existed get the column and a backfill.
+    # Only the oldest copy of an already duplicated post gets a hash, so the
+    # unique index below can be built without deleting anything.
+    cursor.execute('''PRAGMA table_info(post)''')
+    if 'content_hash' not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute('''ALTER TABLE post ADD COLUMN content_hash TEXT''')
+        cursor.execute('''SELECT post_id, category_id, text FROM post ORDER BY post_id''')
+        seen = set()
+        backfill = []
+        for post_id, category_id, text in cursor.fetchall():
+            key = (category_id, contentHash(text))
+            if key not in seen:
+                seen.add(key)
+                backfill.append((key[1], post_id))
+        cursor.executemany('''UPDATE post SET content_hash = ? WHERE post_id = ?''', backfill)
+    
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_post_content ON post (category_id, content_hash)
+    ''')
+    
+    # Posts per category, kept up to date by the triggers below so listings never
+    # COUNT(*) the post table. Databases that predate it get a one-off backfill.
+    cursor.execute('''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_count' ''')
+    backfill_counts = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_count (
+            category_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+    ''')
+    if backfill_counts:
+        cursor.execute('''INSERT INTO post_count (category_id, count)
+                         SELECT category_id, COUNT(*) FROM post GROUP BY category_id''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_count_insert AFTER INSERT ON post
+        BEGIN
+            INSERT INTO post_count (category_id, count) VALUES (NEW.category_id, 1)
+            ON CONFLICT (category_id) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_count_delete AFTER DELETE ON post
+        BEGIN
+            UPDATE post_count SET count = count - 1 WHERE category_id = OLD.category_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_count_update AFTER UPDATE OF category_id ON post
+        WHEN OLD.category_id IS NOT NEW.category_id
+        BEGIN
+            UPDATE post_count SET count = count - 1 WHERE category_id = OLD.category_id;
+            INSERT INTO post_count (category_id, count) VALUES (NEW.category_id, 1)
+            ON CONFLICT (category_id) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    
+    if ARCHIVE_ENABLED:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.post (
+                post_id INTEGER PRIMARY KEY,
+                category_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                created_at TIMESTAMP,
+                content_hash TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS archive.idx_post_category ON post (category_id, post_id)
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_post_content ON post (category_id, content_hash)
+        ''')
+        # Kept up to date by compact_posts(), so listings never COUNT(*) the archive
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.post_count (
+                category_id INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL
+            )
+        ''')
+    
+    # View counts, written in batches by ViewCounter.flush()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_views (
+            post_id INTEGER PRIMARY KEY,
+            views INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_post_views_views ON post_views (views)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_views (
+            category_id INTEGER PRIMARY KEY,
+            views INTEGER NOT NULL
+        )
+    ''')
+    
+    # Form tokens already used to publish, so a resubmitted form is ignored
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_submission (
+            token TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_post_submission_created ON post_submission (created_at)
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''INSERT OR IGNORE INTO blog_meta (key, value) VALUES ('posts_version', 0)''')
+    
+    # Any change to post bumps posts_version, which tells every worker that
+    # its recent posts buffers are stale
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS post_version_{event.lower()} AFTER {event} ON post
+            BEGIN
+                UPDATE blog_meta SET value = value + 1 WHERE key = 'posts_version';
+            END
+        ''')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user (
             id INTEGER PRIMARY KEY,
@@ -159,13 +1017,76 @@ def init_database():
         (3, 'Photography as Self-Expression: Capturing moments and emotions through the lens. Learn composition techniques and develop your unique photographic style.')
     ]
     
-    for category_id, text in sample_posts:
-        cursor.execute('SELECT COUNT(*) FROM post WHERE category_id = ? AND text = ?', (category_id, text))
-        if cursor.fetchone()[0] == 0:  # Only insert if doesn't exist
-            cursor.execute('INSERT INTO post (category_id, text) VALUES (?, ?)', (category_id, text))
+    # Only insert if doesn't exist (checked by the unique content hash index)
+    seeds = [(category_id, text, contentHash(text)) for category_id, text in sample_posts]
+    if ARCHIVE_ENABLED:
+        cursor.execute('SELECT category_id, content_hash FROM archive.post WHERE content_hash IN (%s)'
+                       % ','.join('?' * len(seeds)), [seed[2] for seed in seeds])
+        archived = {(row[0], row[1]) for row in cursor.fetchall()}
+        seeds = [seed for seed in seeds if (seed[0], seed[2]) not in archived]
+    cursor.executemany('INSERT OR IGNORE INTO post (category_id, text, content_hash) VALUES (?, ?, ?)', seeds)
     
-    conn.commit()
-    close_db()
+    cursor.connection.commit()
+    close_db(cursor)
+
+# Archive compaction
+def compact_posts(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=500, pause=0.05):
+    """Move posts older than older_than_days into the archive database
+
+    Works in short batches, each its own transaction, and sleeps between them
+    so live requests can take the write lock. Returns the number of posts moved.
+    """
+    if not ARCHIVE_ENABLED:
+        raise RuntimeError('archive mode is off, set BLOG_ARCHIVE=1')
+    moved = 0
+    cursor = open_db()
+    while True:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''SELECT post_id FROM post
+                         WHERE created_at < datetime('now', ?)
+                         ORDER BY post_id LIMIT ?''', [f'-{older_than_days} days', batch_size])
+        post_ids = [row[0] for row in cursor.fetchall()]
+        if not post_ids:
+            cursor.connection.rollback()
+            break
+        marks = ','.join('?' * len(post_ids))
+        # A duplicate that slipped into main while its original was archived
+        # would break the archive's unique index; the archive copy wins
+        cursor.execute(f'''DELETE FROM post WHERE post_id IN ({marks}) AND EXISTS (
+                              SELECT 1 FROM archive.post a
+                              WHERE a.category_id = post.category_id
+                              AND a.content_hash = post.content_hash)''', post_ids)
+        cursor.execute(f'''INSERT INTO archive.post (post_id, category_id, text, created_at, content_hash)
+                          SELECT post_id, category_id, text, created_at, content_hash
+                          FROM post WHERE post_id IN ({marks})''', post_ids)
+        cursor.execute(f'''SELECT category_id, COUNT(*) FROM post
+                          WHERE post_id IN ({marks}) GROUP BY category_id''', post_ids)
+        cursor.executemany('''INSERT INTO archive.post_count (category_id, count) VALUES (?, ?)
+                             ON CONFLICT (category_id) DO UPDATE SET count = count + excluded.count''',
+                           cursor.fetchall())
+        # The delete triggers bump posts_version, so workers reload their counts
+        cursor.execute(f'''DELETE FROM post WHERE post_id IN ({marks})''', post_ids)
+        cursor.connection.commit()
+        moved += len(post_ids)
+        time.sleep(pause)
+    close_db(cursor)
+    return moved
+
+@app.cli.command('compact-posts')
+@click.option('--older-than-days', default=ARCHIVE_AFTER_DAYS, show_default=True, type=int)
+@click.option('--batch-size', default=500, show_default=True, type=int)
+@click.option('--pause', default=0.05, show_default=True, type=float,
+              help='Seconds to sleep between batches.')
+@click.option('--vacuum', is_flag=True, help='VACUUM the main database afterwards.')
+def compact_posts_command(older_than_days, batch_size, pause, vacuum):
+    """Move old posts into the archive database."""
+    moved = compact_posts(older_than_days, batch_size, pause)
+    click.echo(f'Moved {moved} posts to {ARCHIVE_DB_PATH}')
+    if vacuum:
+        cursor = open_db()
+        cursor.execute('VACUUM main')
+        close_db(cursor)
+        click.echo(f'Vacuumed {DB_PATH}')
 
 # HTML Templates with lower positioning
 BASE_TEMPLATE = '''
@@ -500,6 +1421,15 @@ BASE_TEMPLATE = '''
             opacity: 0.9;
         }
 
+        .pagination {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            gap: 2rem;
+            margin-top: 3rem;
+            color: #666;
+        }
+
         .no-posts {
             text-align: center;
             padding: 4rem;
@@ -611,6 +1541,7 @@ BASE_TEMPLATE = '''
                 <li><a href="/post/category/lifestyle">Lifestyle</a></li>
                 <li><a href="/post/category/creative">Creative</a></li>
                 <li><a href="/post/view">All Posts</a></li>
+                <li><a href="/post/popular">Popular</a></li>
             </ul>
         </nav>
     </header>
@@ -657,6 +1588,255 @@ BASE_TEMPLATE = '''
 </html>
 '''
 
+# Rendered post cards
+class FragmentCache:
+    """LRU cache of rendered HTML fragments, bounded by total characters"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            html = self._items.get(key)
+            if html is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return html
+
+    def put(self, key, html):
+        if len(html) > self.max_size:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = html
+            self.size += len(html)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+post_cards = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+# Cards are cached without their view count; the count goes into VIEWS_SLOT
+VIEWS_SLOT = '<!--views-->'
+
+def render_post_card(post, view, views=None):
+    """Card markup for one post; view is 'category' or 'all' (adds a category link)"""
+    key = (post["post_id"], view)
+    html = post_cards.get(key)
+    if html is None:
+        category_name = escape(post["category_name"])
+        category_title = escape(post["category_name"].title())
+        read_more = ''
+        if view == 'all':
+            read_more = f'''
+                        <a href="/post/category/{category_name}" class="read-more">
+                            More {category_title} Posts →
+                        </a>'''
+        html = f'''
+                <article class="post-card">
+                    <div class="post-image"></div>
+                    <div class="post-content">
+                        <div class="post-meta">
+                            <span>{category_title}</span>
+                            <span>Post #{post["post_id"]}{VIEWS_SLOT}</span>
+                        </div>
+                        <div class="post-text">
+                            {escape(post["text"])}
+                        </div>{read_more}
+                    </div>
+                </article>
+                '''
+        # Posts never change after addPost, so a card is cached until evicted
+        post_cards.put(key, html)
+    views_text = '' if views is None else f' · {views} view{"s" if views != 1 else ""}'
+    return html.replace(VIEWS_SLOT, views_text, 1)
+
+# Listing builders
+# Each returns (posts_html, post_count, post_ids) so identical concurrent
+# requests can share one query and one render through coalesced()
+def build_category_listing(category_name, page):
+    posts, post_count = fetch_listing_page(category_name, page)
+    post_ids = [post["post_id"] for post in posts]
+    views = view_counts.post_totals(post_ids)
+    
+    posts_html = ''
+    if posts:
+        posts_html = '<div class="posts-grid">'
+        posts_html += ''.join(render_post_card(post, 'category', views[post["post_id"]]) for post in posts)
+        posts_html += '</div>'
+        posts_html += render_pagination(f'/post/category/{category_name}', page, post_count)
+    else:
+        posts_html = '''
+        <div class="no-posts">
+            <h3>No posts yet in ''' + category_name.title() + '''</h3>
+            <p>Be the first to share something amazing! Use the form above to write your first ''' + category_name + ''' post.</p>
+            <div style="margin-top: 2rem;">
+                <a href="/" class="cta-button">← Back to Home</a>
+            </div>
+        </div>
+        '''
+    return posts_html, post_count, post_ids
+
+def build_all_posts_listing(page):
+    all_posts, post_count = fetch_listing_page(None, page)
+    post_ids = [post["post_id"] for post in all_posts]
+    views = view_counts.post_totals(post_ids)
+    
+    posts_html = ''
+    if all_posts:
+        posts_html = '<div class="posts-grid">'
+        posts_html += ''.join(render_post_card(post, 'all', views[post["post_id"]]) for post in all_posts)
+        posts_html += '</div>'
+        posts_html += render_pagination('/post/view', page, post_count)
+    else:
+        posts_html = '''
+        <div class="no-posts">
+            <p>No posts available yet. Start by adding some content!</p>
+            <div style="margin-top: 2rem;">
+                <a href="/" class="cta-button">← Back to Home</a>
+            </div>
+        </div>
+        '''
+    
+    return posts_html, post_count, post_ids
+
+def build_popular_listing():
+    posts = getPopularPosts(POPULAR_POSTS)
+    views = view_counts.post_totals([post["post_id"] for post in posts])
+    
+    if not posts:
+        return '''
+        <div class="no-posts">
+            <p>No views counted yet. Check back soon!</p>
+        </div>
+        '''
+    posts_html = '<div class="posts-grid">'
+    posts_html += ''.join(render_post_card(post, 'all', views[post["post_id"]]) for post in posts)
+    posts_html += '</div>'
+    return posts_html
+
+def requested_page(category_name):
+    """?page= clamped to the pages that exist, so it is always a valid offset
+
+    Syncs recent_posts once for the whole request; fetch_listing_page() relies on it.
+    """
+    recent_posts.sync()
+    last_page = max((recent_posts.count(category_name) + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    return min(max(request.args.get('page', 1, type=int), 1), last_page)
+
+def render_pagination(base_url, page, post_count):
+    pages = (post_count + PAGE_SIZE - 1) // PAGE_SIZE
+    if pages <= 1:
+        return ''
+    links = ''
+    if page > 1:
+        links += f'<a href="{base_url}?page={page - 1}" class="read-more">← Newer Posts</a>'
+    links += f'<span>Page {page} of {pages}</span>'
+    if page < pages:
+        links += f'<a href="{base_url}?page={page + 1}" class="read-more">Older Posts →</a>'
+    return f'<div class="pagination">{links}</div>'
+
+# Admission control
+class AdmissionGate:
+    """Caps concurrent requests; a few more may wait briefly, the rest get a 503"""
+
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.shed_queue_full += 1
+                return False
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self.active < self.limit, self.timeout):
+                    self.shed_timeout += 1
+                    return False
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'queue_size': self.queue_size,
+                    'active': self.active, 'waiting': self.waiting,
+                    'admitted': self.admitted, 'shed_queue_full': self.shed_queue_full,
+                    'shed_timeout': self.shed_timeout}
+
+class Overloaded(Exception):
+    """Raised when an admission gate turns a request away"""
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    return Response('The blog is busy right now, please try again shortly.\n', 503,
+                    {'Retry-After': str(ADMISSION_RETRY_AFTER)})
+
+def run_admitted(gate, fn, *args, **kwargs):
+    if not gate.acquire():
+        raise Overloaded(gate.name)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        gate.release()
+
+# Every publish shares one small budget, since SQLite has a single writer anyway
+write_gate = AdmissionGate('write', WRITE_LIMIT, WRITE_QUEUE, ADMISSION_TIMEOUT)
+admission_gates = {'write': write_gate}
+
+def admission_controlled(view):
+    """Give a route its own read budget; POSTs to it go through write_gate
+
+    A GET only hands its gate to coalesced(), so identical concurrent requests
+    share one slot with the single-flight leader instead of each taking one.
+    """
+    read_gate = admission_gates[view.__name__] = AdmissionGate(
+        view.__name__, READ_LIMIT, READ_QUEUE, ADMISSION_TIMEOUT)
+    
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMISSION_ENABLED:
+            return view(*args, **kwargs)
+        if request.method == 'POST':
+            return run_admitted(write_gate, view, *args, **kwargs)
+        g.read_gate = read_gate
+        return view(*args, **kwargs)
+    return wrapper
+
 # Routes
 @app.route("/")
 @app.route("/index")
@@ -708,6 +1888,7 @@ def index():
                                 content=content)
 
 @app.route('/post/category/<category_name>', methods=['GET', 'POST'])
+@admission_controlled
 def postCategory(category_name):
     category_id = getIdByCategory(category_name)
     
@@ -718,45 +1899,21 @@ def postCategory(category_name):
     if request.method == 'POST':
         post_text = request.form.get('post', '').strip()
         if post_text:
-            addPost(category_id, post_text)
-            flash('Your post has been published successfully!', 'success')
+            if addPost(category_id, post_text, request.form.get('form_token')):
+                flash('Your post has been published successfully!', 'success')
+            else:
+                flash('Your post has already been published.', 'success')
         else:
             flash('Please write something before submitting.', 'error')
         return redirect(url_for('postCategory', category_name=category_name))
     
-    posts = getPostsByCategory(category_name)
+    page = requested_page(category_name)
+    posts_html, post_count, post_ids = coalesced(('category', category_name, page),
+                                                 build_category_listing, category_name, page)
+    view_counts.record(category_name, post_ids)
+    category_views = view_counts.category_total(category_name)
     flash_messages = render_flash_messages()
     
-    posts_html = ''
-    if posts:
-        posts_html = '<div class="posts-grid">'
-        for post in posts:
-            posts_html += f'''
-            <article class="post-card">
-                <div class="post-image"></div>
-                <div class="post-content">
-                    <div class="post-meta">
-                        <span>{post["category_name"].title()}</span>
-                        <span>Post #{post["post_id"]}</span>
-                    </div>
-                    <div class="post-text">
-                        {post["text"]}
-                    </div>
-                </div>
-            </article>
-            '''
-        posts_html += '</div>'
-    else:
-        posts_html = '''
-        <div class="no-posts">
-            <h3>No posts yet in ''' + category_name.title() + '''</h3>
-            <p>Be the first to share something amazing! Use the form above to write your first ''' + category_name + ''' post.</p>
-            <div style="margin-top: 2rem;">
-                <a href="/" class="cta-button">← Back to Home</a>
-            </div>
-        </div>
-        '''
-    
     content = f'''
     <!-- Category Hero positioned lower -->
     <section class="category-hero">
@@ -776,6 +1933,7 @@ def postCategory(category_name):
                     Have something interesting to share about {category_name}? Write your thoughts below and contribute to our community!
                 </p>
                 <form method="POST">
+                    <input type="hidden" name="form_token" value="{uuid.uuid4().hex}">
                     <div class="form-group">
                         <label for="post">Your {category_name.title()} Post:</label>
                         <textarea 
@@ -793,12 +1951,14 @@ def postCategory(category_name):
         <section class="posts-section">
             <h2>{category_name.title()} Posts Collection</h2>
             <p style="text-align: center; margin-bottom: 3rem; color: #666; font-size: 1.2rem;">
-                {"Showing " + str(len(posts)) + " post" + ("s" if len(posts) != 1 else "") + " in " + category_name if posts else "No posts yet in this category"}
+                {"Showing " + str(post_count) + " post" + ("s" if post_count != 1 else "") + " in " + category_name if post_count else "No posts yet in this category"}
+                · {category_views} view{"s" if category_views != 1 else ""}
             </p>
             
             {posts_html}
         </section>
     </div>
+    {render_live_updates(f'/post/category/{category_name}/stream') if page == 1 else ''}
     '''
     
     return render_template_string(BASE_TEMPLATE,
@@ -807,42 +1967,13 @@ def postCategory(category_name):
                                 content=content)
 
 @app.route("/post/view")
+@admission_controlled
 def postView():
-    all_posts = get_all_posts()
+    page = requested_page(None)
+    posts_html, post_count, post_ids = coalesced(('all', page), build_all_posts_listing, page)
+    view_counts.record(None, post_ids)
     flash_messages = render_flash_messages()
     
-    posts_html = ''
-    if all_posts:
-        posts_html = '<div class="posts-grid">'
-        for post in all_posts:
-            posts_html += f'''
-            <article class="post-card">
-                <div class="post-image"></div>
-                <div class="post-content">
-                    <div class="post-meta">
-                        <span>{post["category_name"].title()}</span>
-                        <span>Post #{post["post_id"]}</span>
-                    </div>
-                    <div class="post-text">
-                        {post["text"]}
-                    </div>
-                    <a href="/post/category/{post["category_name"]}" class="read-more">
-                        More {post["category_name"].title()} Posts →
-                    </a>
-                </div>
-            </article>
-            '''
-        posts_html += '</div>'
-    else:
-        posts_html = '''
-        <div class="no-posts">
-            <p>No posts available yet. Start by adding some content!</p>
-            <div style="margin-top: 2rem;">
-                <a href="/" class="cta-button">← Back to Home</a>
-            </div>
-        </div>
-        '''
-    
     content = f'''
     <section class="category-hero">
         <div class="container">
@@ -853,10 +1984,11 @@ def postView():
 
     <div class="main-content container">
         <section class="posts-section">
-            <h2>All Blog Posts ({len(all_posts)})</h2>
+            <h2>All Blog Posts ({post_count})</h2>
             {posts_html}
         </section>
     </div>
+    {render_live_updates('/post/stream') if page == 1 else ''}
     '''
     
     return render_template_string(BASE_TEMPLATE,
@@ -864,6 +1996,44 @@ def postView():
                                 flash_messages=flash_messages,
                                 content=content)
 
+@app.route("/post/popular")
+@admission_controlled
+def postPopular():
+    # Not counted as views of the posts: that would feed the ranking itself
+    posts_html = coalesced(('popular',), build_popular_listing)
+    flash_messages = render_flash_messages()
+    
+    content = f'''
+    <section class="category-hero">
+        <div class="container">
+            <h1>Popular Posts</h1>
+            <p>The most viewed posts from every category</p>
+        </div>
+    </section>
+
+    <div class="main-content container">
+        <section class="posts-section">
+            <h2>Top {POPULAR_POSTS} Posts</h2>
+            {posts_html}
+        </section>
+    </div>
+    '''
+    
+    return render_template_string(BASE_TEMPLATE,
+                                title="Popular Posts - My Blog",
+                                flash_messages=flash_messages,
+                                content=content)
+
+@app.route("/post/stream")
+def postStream():
+    return event_stream(None)
+
+@app.route('/post/category/<category_name>/stream')
+def postCategoryStream(category_name):
+    if not getIdByCategory(category_name):
+        return Response(f'Category "{category_name}" not found\n', 404)
+    return event_stream(category_name)
+
 @app.route("/about")
 def about():
     return redirect(url_for('index'))
@@ -879,9 +2049,129 @@ def render_flash_messages():
             messages += '</div>'
     return messages
 
+# Profiling
+# Per request: send "X-Profile: 1" or add ?_profile=1 with admin basic auth.
+# The cProfile dump is written to PROFILE_DIR and named in X-Profile-File;
+# "X-Profile: text" or ?_profile=text returns the top functions instead.
+# Sampling: GET /admin/profile/sample?seconds=N samples this worker's threads
+# and writes collapsed stacks for flamegraph.pl / speedscope.
+def is_admin():
+    auth = request.authorization
+    data = getAuthData()
+    if not auth or not data or auth.username is None or auth.password is None:
+        return False
+    # compare_digest only accepts ASCII str, so compare the UTF-8 bytes
+    return (hmac.compare_digest(auth.username.encode(), data['login'].encode())
+            and hmac.compare_digest(auth.password.encode(), data['password'].encode()))
+
+def admin_required():
+    return Response('Admin login required\n', 401,
+                    {'WWW-Authenticate': 'Basic realm="blog admin"'})
+
+def start_request_profile():
+    mode = request.headers.get('X-Profile') or request.args.get('_profile')
+    if not mode:
+        return None
+    if not is_admin():
+        return admin_required()
+    g.profile_mode = mode
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+    return None
+
+def finish_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{request.endpoint}.prof')
+    profiler.dump_stats(path)
+    
+    if g.profile_mode == 'text':
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        response = Response(out.getvalue(), mimetype='text/plain')
+    response.headers['X-Profile-File'] = path
+    return response
+
+class StackSampler(threading.Thread):
+    """Samples every other thread's stack and writes collapsed-stack output"""
+
+    def __init__(self, seconds, interval, path):
+        super().__init__(name='blog-stack-sampler', daemon=True)
+        self.seconds = seconds
+        self.interval = interval
+        self.path = path
+        self.stacks = {}
+
+    def run(self):
+        deadline = time.monotonic() + self.seconds
+        me = threading.get_ident()
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack = ';'.join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            time.sleep(self.interval)
+        
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(self.path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def profileSample():
+    global _sampler
+    if not is_admin():
+        return admin_required()
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), 300)
+    interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+    with _sampler_lock:
+        if _sampler is not None and _sampler.is_alive():
+            return jsonify(error='a sampling run is already in progress', file=_sampler.path), 409
+        path = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.folded')
+        _sampler = StackSampler(seconds, interval, path)
+        _sampler.start()
+    return jsonify(pid=os.getpid(), seconds=seconds, interval=interval, file=path), 202
+
+if PROFILING_ENABLED:
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.add_url_rule('/admin/profile/sample', 'profileSample', profileSample)
+
+@app.route("/admin/stats")
+def adminStats():
+    if not is_admin():
+        return admin_required()
+    return jsonify(admission={name: gate.stats() for name, gate in admission_gates.items()},
+                   views_dropped=view_counts.dropped,
+                   fragment_cache={'size': post_cards.size, 'hits': post_cards.hits,
+                                   'misses': post_cards.misses})
+
+def init_worker():
+    """Open per-process state; gunicorn.conf.py calls this in post_fork"""
+    global _db
+    # Forget anything inherited from the master, SQLite handles must not cross fork
+    _db = threading.local()
+    category_ids.clear()
+    post_cards.clear()
+    loadCategoryIds()
+    recent_posts.load()
+
 if __name__ == "__main__":
     # Initialize database on first run
     init_database()
+    init_worker()
     print("🚀 Blog application starting...")
     print("📝 Database initialized with sample data")
     
@@ -898,5 +2188,8 @@ if __name__ == "__main__":
     
     app.run(debug=False, port=port, host='0.0.0.0')
 else:
-    # Initialize database when running with gunicorn
+    # Initialize database when running with gunicorn. With preload_app
+    # (gunicorn.conf.py) this runs once in the master, and each worker opens
+    # its connections and caches in init_worker() after fork.
     init_database()
+    close_connection()
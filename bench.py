@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the blog app
+
+Every benchmark runs against a scratch database in a temporary directory,
+so blog.db is never touched.
+
+    python bench.py stampede [--clients 50] [--rounds 5] [--delay 0.05]
+    python bench.py fragments [--posts 5000] [--pages 50] [--repeat 20]
+    python bench.py startup [--workers 1 4 16]
+    python bench.py archive [--posts 200000] [--days 730] [--keep-days 30]
+    python bench.py memory [--posts 100000] [--preview 0] [--budget-kb 512]
+    python bench.py overload [--rate 200] [--duration 10] [--threads 32]
+"""
+
+import argparse
+import atexit
+import concurrent.futures
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+
+
+def load_app(tmpdir):
+    """Import app.py against a scratch database inside tmpdir"""
+    os.environ['BLOG_DB_PATH'] = os.path.join(tmpdir, 'bench.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as blog
+    # Scratch data: don't flush view counts into a directory that is gone by exit
+    atexit.unregister(blog.view_counts.flush)
+    return blog
+
+
+def seed_posts(blog, count):
+    """Bulk insert `count` posts spread over the sample categories"""
+    cursor = blog.open_db()
+    texts = (f'Benchmark post {i}: ' + 'lorem ipsum ' * 20 for i in range(count))
+    cursor.executemany('INSERT INTO post (category_id, text, content_hash) VALUES (?, ?, ?)',
+                       ((i % 3 + 1, text, blog.contentHash(text)) for i, text in enumerate(texts)))
+    cursor.connection.commit()
+    blog.close_db(cursor)
+    blog.recent_posts.load()
+
+
+def count_listing_queries(blog):
+    """Patch open_db so every listing SELECT on the post table is counted"""
+    counter = {'queries': 0}
+    lock = threading.Lock()
+    real_open_db = blog.open_db
+
+    def trace(statement):
+        if statement.lstrip().upper().startswith('SELECT P.'):
+            with lock:
+                counter['queries'] += 1
+
+    def open_db():
+        cursor = real_open_db()
+        cursor.connection.set_trace_callback(trace)
+        return cursor
+
+    blog.open_db = open_db
+    return counter
+
+
+def slow_down(blog, name, delay):
+    """Make a db helper take at least `delay` seconds, like a busy disk would"""
+    real = getattr(blog, name)
+
+    def wrapper(*args, **kwargs):
+        time.sleep(delay)
+        return real(*args, **kwargs)
+
+    setattr(blog, name, wrapper)
+
+
+def run_burst(blog, path, clients):
+    barrier = threading.Barrier(clients)
+    statuses = []
+
+    def client():
+        test_client = blog.app.test_client()
+        barrier.wait()
+        statuses.append(test_client.get(path).status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    if any(status not in (200, 503) for status in statuses):
+        raise SystemExit(f'unexpected statuses for {path}: {sorted(set(statuses))}')
+    return elapsed, statuses.count(503)
+
+
+def bench_stampede(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blog = load_app(tmpdir)
+        seed_posts(blog, 3000)
+        counter = count_listing_queries(blog)
+        slow_down(blog, 'getPostsByCategory', args.delay)
+        slow_down(blog, 'get_all_posts', args.delay)
+
+        print(f'{args.clients} concurrent clients x {args.rounds} rounds, '
+              f'{args.delay * 1000:.0f} ms simulated query latency')
+        print(f'{"path":<32} {"coalescing":<11} {"gates":<6} {"queries":>8} {"shed":>6} {"wall ms":>9}')
+        # Pages past the in-memory recent posts, so every miss reaches the database.
+        # The with/without comparison runs ungated, since admission control would
+        # shed most of the uncoalesced stampede; the last row checks that gated
+        # followers share their leader's read slot and are never shed.
+        for path in ('/post/category/tech?page=10', '/post/view?page=10'):
+            for coalescing, gates in ((False, False), (True, False), (True, True)):
+                blog.COALESCE_REQUESTS = coalescing
+                blog.ADMISSION_ENABLED = gates
+                counter['queries'] = 0
+                elapsed = 0.0
+                shed = 0
+                for _ in range(args.rounds):
+                    burst_elapsed, burst_shed = run_burst(blog, path, args.clients)
+                    elapsed += burst_elapsed
+                    shed += burst_shed
+                print(f'{path:<32} {"on" if coalescing else "off":<11} {"on" if gates else "off":<6} '
+                      f'{counter["queries"]:>8} {shed:>6} {elapsed * 1000:>9.1f}')
+                if coalescing and shed:
+                    raise SystemExit(f'coalesced requests to {path} were shed')
+
+
+def cpu_per_call(fn, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - started) / repeat
+
+
+def bench_fragments(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blog = load_app(tmpdir)
+        seed_posts(blog, args.posts)
+        cards = blog.post_cards
+        cache_size = cards.max_size
+        pages = range(1, args.pages + 1)
+
+        def html_only():
+            for page in pages:
+                blog.build_all_posts_listing(page)
+
+        test_client = blog.app.test_client()
+
+        def full_requests():
+            for page in pages:
+                test_client.get(f'/post/view?page={page}')
+
+        print(f'{args.pages} pages of /post/view ({blog.PAGE_SIZE} posts each), '
+              f'CPU time per listing page')
+        print(f'{"measure":<18} {"no cache us":>12} {"cached us":>10} {"saved us":>9}')
+        for name, fn in (('html building', html_only), ('full request', full_requests)):
+            cards.max_size = 0
+            cards.clear()
+            cold = cpu_per_call(fn, args.repeat) / args.pages
+            cards.max_size = cache_size
+            fn()
+            warm = cpu_per_call(fn, args.repeat) / args.pages
+            print(f'{name:<18} {cold * 1e6:>12.1f} {warm * 1e6:>10.1f} '
+                  f'{(cold - warm) * 1e6:>9.1f}')
+        print(f'cache: {len(cards._items)} cards, {cards.size} chars, '
+              f'{cards.hits} hits, {cards.misses} misses')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory_kb(pid):
+    """(RSS, PSS) of a process in kB; PSS splits copy-on-write pages between sharers"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key] = int(rest.split()[0])
+    return values['Rss'], values['Pss']
+
+
+def start_gunicorn(tmpdir, workers, preload, extra_env=None):
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    env = dict(os.environ,
+               BLOG_DB_PATH=os.path.join(tmpdir, f'gunicorn-{port}.db'),
+               BLOG_PRELOAD='1' if preload else '0')
+    env.update(extra_env or {})
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app',
+         '--workers', str(workers), '--bind', f'127.0.0.1:{port}'],
+        cwd=project_dir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}/post/view'
+    while True:
+        if proc.poll() is not None:
+            raise SystemExit(f'gunicorn exited with status {proc.returncode}')
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+            proc.blog_port = port
+            return proc, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.005)
+
+
+def bench_startup(args):
+    print(f'{"workers":>7} {"preload":<8} {"first req ms":>12} '
+          f'{"RSS/worker MB":>14} {"PSS/worker MB":>14}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for workers in args.workers:
+            for preload in (False, True):
+                proc, first_request = start_gunicorn(tmpdir, workers, preload)
+                try:
+                    # Let the rest of the workers finish booting before measuring
+                    deadline = time.time() + 30
+                    while len(worker_pids(proc.pid)) < workers and time.time() < deadline:
+                        time.sleep(0.05)
+                    time.sleep(args.settle)
+                    usage = [memory_kb(pid) for pid in worker_pids(proc.pid)]
+                finally:
+                    proc.send_signal(signal.SIGTERM)
+                    proc.wait()
+                rss = sum(r for r, _ in usage) / len(usage) / 1024
+                pss = sum(p for _, p in usage) / len(usage) / 1024
+                print(f'{workers:>7} {"on" if preload else "off":<8} '
+                      f'{first_request * 1000:>12.1f} {rss:>14.1f} {pss:>14.1f}')
+
+
+def median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+def bench_archive(args):
+    os.environ['BLOG_ARCHIVE'] = '1'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blog = load_app(tmpdir)
+        # Spread evenly over the last args.days days, oldest first like real ids
+        step = args.days * 24 * 3600 / args.posts
+        texts = ((i, f'Archived benchmark post {i}: ' + 'lorem ipsum ' * 20) for i in range(args.posts))
+        cursor = blog.open_db()
+        cursor.executemany(
+            '''INSERT INTO post (category_id, text, created_at, content_hash)
+               VALUES (?, ?, datetime('now', ?), ?)''',
+            ((i % 3 + 1, text, f'-{int((args.posts - i) * step)} seconds', blog.contentHash(text))
+             for i, text in texts))
+        cursor.connection.commit()
+        blog.close_db(cursor)
+        blog.post_cards.max_size = 0  # measure the queries, not cached cards
+
+        test_client = blog.app.test_client()
+        pages = (1, 5, 50)
+
+        def measure(label):
+            blog.recent_posts.load()
+            reload_ms = median_ms(blog.recent_posts.load, 5)
+            last_page = (blog.recent_posts.count() + blog.PAGE_SIZE - 1) // blog.PAGE_SIZE
+            results = [median_ms(lambda: test_client.get(f'/post/view?page={page}'), args.repeat)
+                       for page in pages + (last_page,)]
+            size_mb = os.path.getsize(blog.DB_PATH) / 1024 / 1024
+            print(f'{label:<15} {blog.recent_posts.hot_count():>9} {size_mb:>8.1f} {reload_ms:>10.1f} '
+                  + ' '.join(f'{ms:>9.2f}' for ms in results))
+
+        print(f'{args.posts} posts over {args.days} days, archive after {args.keep_days} days, '
+              f'median ms per /post/view request')
+        print(f'{"":<15} {"hot rows":>9} {"main MB":>8} {"reload ms":>10} '
+              + ' '.join(f'{"page " + str(page):>9}' for page in pages) + f' {"last page":>9}')
+        measure('before compact')
+
+        started = time.perf_counter()
+        moved = blog.compact_posts(args.keep_days, batch_size=5000, pause=0)
+        compact_s = time.perf_counter() - started
+        cursor = blog.open_db()
+        started = time.perf_counter()
+        cursor.execute('VACUUM main')
+        vacuum_s = time.perf_counter() - started
+        blog.close_db(cursor)
+        measure('after compact')
+        print(f'moved {moved} posts in {compact_s:.1f} s, then VACUUM main took {vacuum_s:.2f} s')
+
+
+def traced_peak_kb(fn):
+    """(peak, retained) kB allocated by Python while running fn"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak / 1024, retained / 1024
+
+
+def bench_memory(args):
+    if args.preview:
+        os.environ['BLOG_PREVIEW_CHARS'] = str(args.preview)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blog = load_app(tmpdir)
+        seed_posts(blog, args.posts)
+        test_client = blog.app.test_client()
+        test_client.get('/post/view')  # first request sets up Flask internals
+
+        def full_rows():
+            cursor = blog.open_db()
+            cursor.execute('''SELECT p.*, c.category_name
+                             FROM post p
+                             JOIN category c ON p.category_id = c.category_id
+                             ORDER BY p.post_id DESC''')
+            rows = cursor.fetchall()
+            blog.close_db(cursor)
+            return rows
+
+        print(f'{args.posts} posts, preview {args.preview or "off"}; tracemalloc kB')
+        print(f'{"whole listing in memory":<34} {"peak":>9} {"retained":>9}')
+        for label, fn in (('sqlite3.Row, SELECT p.*', full_rows),
+                          ('PostRecord, narrow columns', blog.get_all_posts)):
+            peak, retained = traced_peak_kb(fn)
+            print(f'{label:<34} {peak:>9.0f} {retained:>9.0f}')
+
+        last_page = (blog.recent_posts.count() + blog.PAGE_SIZE - 1) // blog.PAGE_SIZE
+        print(f'\n{"one request (budget " + str(args.budget_kb) + " kB)":<34} {"peak":>9}')
+        over = []
+        for path in ('/post/view', f'/post/view?page={last_page // 2}', f'/post/view?page={last_page}',
+                     '/post/category/tech', f'/post/category/tech?page={last_page // 6}'):
+            # Cold card cache: the worst case for a request
+            blog.post_cards.clear()
+            peak, _ = traced_peak_kb(lambda: test_client.get(path))
+            print(f'{path:<34} {peak:>9.0f}')
+            if peak > args.budget_kb:
+                over.append(path)
+        if over:
+            raise SystemExit(f'over the {args.budget_kb} kB budget: {", ".join(over)}')
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def bench_overload(args):
+    """Open-loop load: requests leave on a fixed schedule whether or not earlier
+    ones have finished, and latency counts from the scheduled send time"""
+    print(f'{args.rate} requests/s for {args.duration:.0f} s against 1 worker x '
+          f'{args.threads} threads, {args.write_ratio:.0%} publishes')
+    print(f'{"admission":<10} {"ok/s":>7} {"503":>7} {"ok p50 ms":>10} {"ok p99 ms":>10} '
+          f'{"all p99 ms":>11} {"errors":>7}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for enabled in (False, True):
+            extra_env = {'BLOG_ADMISSION': '1' if enabled else '0',
+                         'BLOG_THREADS': str(args.threads)}
+            proc, _ = start_gunicorn(tmpdir, 1, True, extra_env)
+            port = proc.blog_port
+            ok, shed, everything = [], [], []
+            errors = [0]
+            lock = threading.Lock()
+
+            def send(i, scheduled):
+                write = i % 100 < args.write_ratio * 100
+                try:
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    if write:
+                        body = urllib.parse.urlencode({'post': f'Load test post {i} {time.time()}'})
+                        conn.request('POST', '/post/category/tech', body,
+                                     {'Content-Type': 'application/x-www-form-urlencoded'})
+                    else:
+                        conn.request('GET', '/post/view' if i % 2 else '/post/category/tech')
+                    status = conn.getresponse().status
+                    conn.close()
+                except OSError:
+                    with lock:
+                        errors[0] += 1
+                    return
+                elapsed = (time.perf_counter() - scheduled) * 1000
+                with lock:
+                    everything.append(elapsed)
+                    (shed if status == 503 else ok).append(elapsed)
+
+            total = int(args.rate * args.duration)
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=args.connections) as pool:
+                    start = time.perf_counter()
+                    for i in range(total):
+                        scheduled = start + i / args.rate
+                        delay = scheduled - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        pool.submit(send, i, scheduled)
+            finally:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait()
+            print(f'{"on" if enabled else "off":<10} {len(ok) / args.duration:>7.0f} {len(shed):>7} '
+                  f'{percentile(ok, 0.5):>10.1f} {percentile(ok, 0.99):>10.1f} '
+                  f'{percentile(everything, 0.99):>11.1f} {errors[0]:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    stampede = sub.add_parser('stampede', help='concurrent identical listing requests')
+    stampede.add_argument('--clients', type=int, default=50)
+    stampede.add_argument('--rounds', type=int, default=5)
+    stampede.add_argument('--delay', type=float, default=0.05,
+                          help='simulated query latency in seconds')
+    stampede.set_defaults(func=bench_stampede)
+
+    fragments = sub.add_parser('fragments', help='CPU saved by the post card cache')
+    fragments.add_argument('--posts', type=int, default=5000)
+    fragments.add_argument('--pages', type=int, default=50)
+    fragments.add_argument('--repeat', type=int, default=20)
+    fragments.set_defaults(func=bench_fragments)
+
+    startup = sub.add_parser('startup', help='gunicorn time-to-first-request and memory')
+    startup.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    startup.add_argument('--settle', type=float, default=1.0,
+                         help='seconds to wait for workers before reading memory')
+    startup.set_defaults(func=bench_startup)
+
+    archive = sub.add_parser('archive', help='hot page latency before and after archiving')
+    archive.add_argument('--posts', type=int, default=200000)
+    archive.add_argument('--days', type=int, default=730)
+    archive.add_argument('--keep-days', type=int, default=30)
+    archive.add_argument('--repeat', type=int, default=20)
+    archive.set_defaults(func=bench_archive)
+
+    memory = sub.add_parser('memory', help='per-request memory budget on a large listing')
+    memory.add_argument('--posts', type=int, default=100000)
+    memory.add_argument('--preview', type=int, default=0,
+                        help='BLOG_PREVIEW_CHARS to run with (0 = full text)')
+    memory.add_argument('--budget-kb', type=int, default=512)
+    memory.set_defaults(func=bench_memory)
+
+    overload = sub.add_parser('overload', help='latency and shed requests under overload')
+    overload.add_argument('--rate', type=int, default=200, help='requests per second to offer')
+    overload.add_argument('--duration', type=float, default=10.0)
+    overload.add_argument('--threads', type=int, default=32, help='gunicorn threads (BLOG_THREADS)')
+    overload.add_argument('--connections', type=int, default=256,
+                          help='client connections that may be in flight at once')
+    overload.add_argument('--write-ratio', type=float, default=0.1)
+    overload.set_defaults(func=bench_overload)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
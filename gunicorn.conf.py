@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for the blog
+
+gunicorn reads this file automatically when started from the project
+directory, so the usual `gunicorn app:app` start command picks it up.
+The worker count comes from WEB_CONCURRENCY, as gunicorn does by default.
+"""
+
+import os
+
+# Import app.py once in the master: the schema and seed run a single time and
+# the imported code is shared copy-on-write. BLOG_PRELOAD=0 makes every
+# worker import the app itself.
+preload_app = os.environ.get('BLOG_PRELOAD', '1') != '0'
+
+# Threaded workers: a live /stream reader holds one thread for as long as the
+# tab stays open, and requests over the admission limits in app.py must reach
+# a thread to be turned away with a quick 503. Keep this above the sum of the
+# per-route limits and queues plus BLOG_STREAM_MAX_CLIENTS.
+threads = int(os.environ.get('BLOG_THREADS', 32))
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
+
+
+def worker_exit(server, worker):
+    # Write buffered view counts before the worker goes away
+    import app
+    app.view_counts.flush()